@@ -1,12 +1,8 @@
-# IPDB can be used for debugging.
-# Ignoring flake8 error code F401
-import ipdb  # noqa: F401
+import concurrent.futures
+import os
+
 import numpy as np
 import tensorflow as tf
-from keras.preprocessing.image import img_to_array, load_img
-from numba import float32, int32, jit, njit, types
-from numba.typed import List
-from numpy import loadtxt
 
 
 class DataFeeder:
@@ -20,11 +16,13 @@ class DataFeeder:
     def __init__(
         self,
         storage_path: str,
+        input_shape: tuple,
         num_queries: int,
         num_classes: int,
         fm_shape: tuple,
         dim_transformer: int,
         batch_size: int,
+        cache_path: str = None,
     ):
         """Initialize Data Feeder
 
@@ -32,6 +30,8 @@ class DataFeeder:
         ----------
         storage_path : str
             Path to data storage.
+        input_shape : tuple
+            Shape of the input images [H, W, C].
         num_queries : int
             Number of queries used in transformer network.
         num_classes : int
@@ -41,17 +41,46 @@ class DataFeeder:
         dim_transformer : int
             Number of neurons in multi-head attention layers.
             Should be a multiple of `num_heads`.
+        batch_size : int
+            Number of samples per batch.
+        cache_path : str, optional
+            Path to store the decoded images at. If specified, all images in `storage_path`
+            get decoded once at initialization and are read from the cache afterwards.
         """
         self.name = "DataFeeder"
         self.path = storage_path
+        self.input_shape = tuple(input_shape)
         self.num_queries = np.int32(num_queries)
         self.num_classes = np.int32(num_classes)
         self.fm_shape = fm_shape
         self.dim_transformer = np.int32(dim_transformer)
-        self.positional_encodings = create_positional_encodings(
-            fm_shape=fm_shape, num_pos_feats=dim_transformer // 2, batch_size=batch_size
+        self.batch_size = batch_size
+
+        # Images and labels of a batch get loaded concurrently
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(32, 2 * (os.cpu_count() or 1))
         )
 
+        # Decoded image cache, built before any data gets loaded
+        self.cache_path = cache_path
+        self._image_cache = None
+        self._cache_index = None
+        if cache_path:
+            self._build_cache()
+
+        # The positional encodings are constant, therefore they get created and placed
+        # on the device only once and are broadcasted over the batch in the transformer.
+        # They are stored in the float type the transformer computes in, which follows
+        # the mixed precision policy, e.g. float16 for `mixed_float16`.
+        with tf.device("/GPU:0"):
+            self.positional_encodings = tf.identity(
+                create_positional_encodings(
+                    fm_shape=fm_shape,
+                    num_pos_feats=dim_transformer // 2,
+                    dtype=tf.keras.mixed_precision.global_policy().compute_dtype,
+                )
+            )
+
     def __call__(self, batch_uuids: list):
         """Call data feeder.
 
@@ -63,7 +92,7 @@ class DataFeeder:
         Returns
         -------
         batch_inputs : tf.Tensor
-            Batch input images of shape [Batch Size, H, W, C].
+            Batch input images of shape [Batch Size, H, W, C] and type uint8.
         batch_cls : tf.Tensor
             Batch class targets of shape [Batch Size, #Queries, 1].
         batch_bbox : tf.Tensor
@@ -72,31 +101,26 @@ class DataFeeder:
             Helper tensor of shape [Batch Size, None].
             Used to link objects in the cost matrix to the target tensors.
         positional_encodings : tf.Tensor
-            Positional encodings of shape [Batch Size, H*W, dim_transformer].
+            Positional encodings of shape [1, H*W, dim_transformer].
             Used in transformer network to enrich input information.
         """
-        batch_inputs, batch_labels = self.load_data(batch_uuids)
-
-        batch_cls = []
-        batch_bbox = []
-        batch_size = len(batch_uuids)
-
-        for idx in np.arange(0, batch_size, dtype=np.int32):
-            sample_labels = np.array(batch_labels[idx], dtype=np.float32)
-
-            sample_cls, sample_bbox = labels_to_targets(
-                sample_labels, self.num_queries, self.num_classes
-            )
+        batch_inputs, batch_labels, counts = self.load_data(batch_uuids)
 
-            batch_cls.append(sample_cls)
-            batch_bbox.append(sample_bbox)
+        # E.g. a batch of 3 samples with varying number of objects (1, 3, 1) will
+        # produce a mapping [[0], [1,2,3], [4]], needed in the bipartite matching
+        row_splits = np.concatenate([[0], np.cumsum(counts)])
+        obj_indices = tf.RaggedTensor.from_row_splits(
+            np.arange(row_splits[-1], dtype=np.int64), row_splits
+        )
 
-        obj_indices = retrieve_obj_indices(np.array(batch_cls))
-        obj_indices = tf.ragged.constant(obj_indices, dtype=tf.int64)
+        # Contiguous arrays get converted without an additional packing copy
+        batch_inputs = tf.convert_to_tensor(np.ascontiguousarray(batch_inputs))
 
-        batch_inputs = tf.convert_to_tensor(batch_inputs, dtype=tf.float32)
-        batch_cls = tf.convert_to_tensor(batch_cls, dtype=tf.float32)
-        batch_bbox = tf.convert_to_tensor(batch_bbox, dtype=tf.float32)
+        # Labels are already padded with `num_classes` to [Batch Size, #Queries, 5].
+        # Class and bounding box targets are sliced from a single converted buffer
+        targets = tf.convert_to_tensor(batch_labels)
+        batch_cls = targets[:, :, :1]
+        batch_bbox = targets[:, :, 1:]
 
         return (
             batch_inputs,
@@ -106,38 +130,151 @@ class DataFeeder:
             self.positional_encodings,
         )
 
+    def close(self):
+        """Shut down the thread pool used to load the batches."""
+        self.pool.shutdown(wait=False)
+
+    def __del__(self):
+        # The pool is missing if the initialization failed before creating it
+        if hasattr(self, "pool"):
+            self.close()
+
+    def load_sample(self, uuid: tf.Tensor):
+        """Load the image and labels of the given uuid inside a `tf.data` pipeline.
+
+        Parameters
+        ----------
+        uuid : tf.Tensor
+            Scalar string tensor holding the UUID of a given sample.
+
+        Returns
+        -------
+        image : tf.Tensor
+            Image of shape [H, W, C] and type uint8.
+        labels : tf.Tensor
+            Labels of shape [#Objects, 5].
+        """
+        image_path = tf.strings.join([self.path, "/images/", uuid, ".jpg"])
+
+        if self.cache_path:
+            # Images missing in the cache are returned empty and decoded from storage
+            image = tf.numpy_function(self._load_cached_image, [uuid], tf.uint8)
+            image = tf.cond(
+                tf.size(image) > 0,
+                lambda: image,
+                lambda: tf.io.decode_jpeg(tf.io.read_file(image_path), channels=3),
+            )
+        else:
+            image = tf.io.decode_jpeg(tf.io.read_file(image_path), channels=3)
+        image = tf.ensure_shape(image, self.input_shape)
+
+        # Strip comments and parse the whitespace separated label rows
+        label_path = tf.strings.join([self.path, "/labels/", uuid, ".txt"])
+        labels = tf.strings.regex_replace(tf.io.read_file(label_path), "#[^\\n]*", "")
+        labels = tf.strings.to_number(tf.strings.split(labels), out_type=tf.float32)
+        labels = tf.reshape(labels, shape=(-1, 5))
+
+        return image, labels
+
+    def finalize_batch(self, batch_inputs: tf.Tensor, batch_labels: tf.RaggedTensor):
+        """Turn a batch of loaded samples into the targets required by the DETR model.
+
+        Parameters
+        ----------
+        batch_inputs : tf.Tensor
+            Batch input images of shape [Batch Size, H, W, C] and type uint8.
+        batch_labels : tf.RaggedTensor
+            Batch labels of shape [Batch Size, None, 5].
+
+        Returns
+        -------
+        batch_inputs : tf.Tensor
+            Batch input images of shape [Batch Size, H, W, C] and type uint8.
+        batch_cls : tf.Tensor
+            Batch class targets of shape [Batch Size, #Queries, 1].
+        batch_bbox : tf.Tensor
+            Batch bounding box targets of shape [Batch Size, #Queries, 4].
+        obj_indices : tf.RaggedTensor
+            Helper tensor of shape [Batch Size, None].
+            Used to link objects in the cost matrix to the target tensors.
+        """
+        # Samples with more objects than queries can't be matched, fail instead of
+        # silently dropping the surplus objects
+        row_lengths = batch_labels.row_lengths()
+        with tf.control_dependencies(
+            [
+                tf.debugging.assert_less_equal(
+                    row_lengths,
+                    tf.cast(self.num_queries, dtype=tf.int64),
+                    message="Sample contains more objects than num_queries",
+                )
+            ]
+        ):
+            row_lengths = tf.identity(row_lengths)
+
+        obj_indices = tf.RaggedTensor.from_row_lengths(
+            tf.range(tf.reduce_sum(row_lengths), dtype=tf.int64), row_lengths
+        )
+
+        batch_labels = batch_labels.to_tensor(
+            default_value=float(self.num_classes),
+            shape=[None, int(self.num_queries), 5],
+        )
+        batch_cls = batch_labels[:, :, :1]
+        batch_bbox = batch_labels[:, :, 1:]
+
+        return batch_inputs, batch_cls, batch_bbox, obj_indices
+
     def load_data(self, batch_uuids: list):
         """Load the images and labels of the corresponding uuids.
 
         Parameters
         ----------
         batch_uuids : list
-            Description
+            List of uuids of images in `storage_path`.
 
         Returns
         -------
         batch_inputs : np.array
-            Batch images of shape [Batch Size, H, W, C]
+            Batch images of shape [Batch Size, H, W, C] and type uint8
         batch_labels : np.array
-            Batch labels of shape [Batch Size, #Objects, 5].
-            The array is nested, such that each sample can have varying number of objects.
-            Further, the last dimension speciefies the cls (1) and the coordinates (4).
+            Batch labels of shape [Batch Size, #Queries, 5], padded with `num_classes`.
+            The last dimension speciefies the cls (1) and the coordinates (4).
+        counts : np.array
+            Number of objects in each sample of shape [Batch Size].
         """
 
-        batch_inputs = []
-        batch_labels = []
+        futures = [self.pool.submit(self._load_one, uuid) for uuid in batch_uuids]
 
-        for sample_uuid in batch_uuids:
-            img = self.loadimage(sample_uuid)
-            label = self.loadlabel(sample_uuid)
+        batch_inputs = np.empty(
+            shape=(len(batch_uuids),) + self.input_shape, dtype=np.uint8, order="C"
+        )
+        batch_labels = np.full(
+            shape=(len(batch_uuids), self.num_queries, 5),
+            fill_value=self.num_classes,
+            dtype=np.float32,
+            order="C",
+        )
+        counts = np.empty(shape=len(batch_uuids), dtype=np.int64)
 
-            batch_inputs.append(img)
-            batch_labels.append(label)
+        for idx, future in enumerate(futures):
+            img, label = future.result()
 
-        return np.array(batch_inputs), np.array(batch_labels)
+            if len(label) > self.num_queries:
+                raise ValueError(
+                    "Sample {} contains more objects than num_queries ({} > {})".format(
+                        batch_uuids[idx], len(label), self.num_queries
+                    )
+                )
 
-    def loadimage(self, uuid: str):
-        """Load and return the image given the specified uuid.
+            batch_inputs[idx] = img
+            batch_labels[idx, : len(label)] = label
+            counts[idx] = len(label)
+
+        return batch_inputs, batch_labels, counts
+
+    def _load_one(self, uuid: str):
+        """Load the image and labels of a single uuid. Executed in `self.pool`.
 
         Parameters
         ----------
@@ -146,17 +283,15 @@ class DataFeeder:
 
         Returns
         -------
-        np.array
-            Image of shape [H, W]
-
+        img : np.array
+            Image of shape [H, W, C] and type uint8
+        label : np.array
+            Labels of shape [#Objects, 5]
         """
-        image_path = "{}/images/{}.jpg".format(self.path, uuid)
-        return img_to_array(load_img(image_path), dtype=np.float32)
+        return self.loadimage(uuid), self.loadlabel(uuid)
 
-    def loadlabel(self, uuid: str):
-        """Load and return the labels given the specified uuid. The label contains the
-        classes and the coordinates of the bounding boxes and the length of the labels corresponds
-        to the number of objects in the image.
+    def loadimage(self, uuid: str):
+        """Load and return the image given the specified uuid.
 
         Parameters
         ----------
@@ -166,98 +301,115 @@ class DataFeeder:
         Returns
         -------
         np.array
-            Labels of shape [#Objects, 5]
+            Image of shape [H, W, C] and type uint8
+
         """
+        if self.cache_path and uuid in self._cache_index:
+            return self._image_cache[self._cache_index[uuid]]
 
-        label_path = "{}/labels/{}.txt".format(self.path, uuid)
-        labels = loadtxt(label_path, comments="#", delimiter=" ", unpack=False)
-        if labels.ndim == 1:
-            return labels.reshape((1, 5))
-        return np.array(labels, dtype=np.float32)
+        return self._decode_image(uuid)
 
+    def _decode_image(self, uuid: str):
+        """Read and decode the image of the specified uuid from `storage_path`.
 
-@jit(types.UniTuple(float32[:, :], 2)(float32[:, :], int32, int32))
-def labels_to_targets(sample_labels, num_queries, num_classes):
-    """Prepare the true target class and bounding boxes to be aligned with detr output.
+        Parameters
+        ----------
+        uuid : str
+            UUID of a given sample
 
-        Important information regarding Input
-        -------------------------------------
-            * Each row in the labels consists of [class, x_center, y_center, width, height]
-            * Coordinates are normalized by image width (x,w) and image height (y,h)
-            * Class numbers start by 0
+        Returns
+        -------
+        np.array
+            Image of shape [H, W, C] and type uint8
+        """
+        image_path = "{}/images/{}.jpg".format(self.path, uuid)
+        return tf.io.decode_jpeg(tf.io.read_file(image_path), channels=3).numpy()
 
+    def _load_cached_image(self, uuid: bytes):
+        """Return the cached image of the specified uuid. Used via `tf.numpy_function`
+        inside the `tf.data` pipeline.
 
         Parameters
         ----------
-        sample_labels : list
-            Ground truth/Labeled objects corresponding to the given image
-        num_queries : int
-            num_queriesumber of detections per image
+        uuid : bytes
+            UUID of a given sample
 
         Returns
         -------
-        sample_cls : np.array
-            Ground truth class labels of the image in shape [num_queries], padded with `num_classes`.
-        sample_bbox : np.array
-            Ground truth bounding boxes of the image in shape [num_queries, 4] in centroid format
-            [class, x_center, y_center, width, height]
-
+        np.array
+            Image of shape [H, W, C] and type uint8. Empty if the uuid is not cached.
         """
-    sample_cls = np.full(
-        shape=(num_queries, 1), fill_value=num_classes, dtype=np.float32
-    )
-    sample_bbox = np.full(
-        shape=(num_queries, 4), fill_value=num_classes, dtype=np.float32
-    )
+        row = self._cache_index.get(uuid.decode())
+        if row is None:
+            return np.empty(shape=(0, 0, self.input_shape[2]), dtype=np.uint8)
+        return np.array(self._image_cache[row])
+
+    def _build_cache(self):
+        """Decode all images in `storage_path` once and store them as memory mapped
+        array in `cache_path`. An existing cache is reused, such that the images get only
+        decoded once across epochs and training runs. It is rebuilt if it doesn't cover
+        the same images or the same `input_shape` anymore.
+        """
+        images_path = "{}/images.npy".format(self.cache_path)
+        uuids_path = "{}/uuids.txt".format(self.cache_path)
+        uuids = [img.split(".")[0] for img in os.listdir(self.path + "/images")]
+        cache_shape = (len(uuids),) + self.input_shape
+
+        # The uuids get written last, such that an interrupted build is repeated
+        if os.path.exists(uuids_path) and os.path.exists(images_path):
+            with open(uuids_path, "r") as fp:
+                cached_uuids = fp.read().split()
+            image_cache = np.load(images_path, mmap_mode="r")
+
+            if set(cached_uuids) == set(uuids) and image_cache.shape == cache_shape:
+                self._cache_index = {uuid: row for row, uuid in enumerate(cached_uuids)}
+                self._image_cache = image_cache
+                return
+
+            del image_cache
+            os.remove(uuids_path)
+
+        os.makedirs(self.cache_path, exist_ok=True)
+        image_cache = np.lib.format.open_memmap(
+            images_path, mode="w+", dtype=np.uint8, shape=cache_shape
+        )
+        for row, image in enumerate(self.pool.map(self._decode_image, uuids)):
+            image_cache[row] = image
 
-    for idx, labeled_obj in enumerate(sample_labels):
-        cls_label, x, y, w, h = labeled_obj
-        sample_cls[idx] = cls_label
-        sample_bbox[idx, :] = x, y, w, h
+        image_cache.flush()
+        del image_cache
 
-    return sample_cls, sample_bbox
+        with open(uuids_path, "w") as fp:
+            fp.write("\n".join(uuids))
 
+        self._cache_index = {uuid: row for row, uuid in enumerate(uuids)}
+        self._image_cache = np.load(images_path, mmap_mode="r")
 
-@njit
-def retrieve_obj_indices(batch_cls):
-    """Helper function to save the object indices for later.
-    E.g. a batch of 3 samples with varying number of objects (1, 3, 1) will
-    produce a mapping [[0], [1,2,3], [4]]. This will be needed later on in the
-    bipartite matching.
+    def loadlabel(self, uuid: str):
+        """Load and return the labels given the specified uuid. The label contains the
+        classes and the coordinates of the bounding boxes and the length of the labels corresponds
+        to the number of objects in the image.
 
-    Parameters
-    ----------
-    batch_cls : np.array
-        Batch class targets of shape [Batch Size, #Queries, 1].
+        Parameters
+        ----------
+        uuid : str
+            UUID of a given sample
 
-    Returns
-    -------
-    np.array
-        Object indices indicating for each sample at which position the
-        associated objects are.
-    """
-    obj_indices = List()
-    batch_size = batch_cls.shape[0]
-
-    for idx in np.arange(0, batch_size, dtype=np.int32):
-        sample = batch_cls[idx]
-        object_indices = np.where(sample != 4.0)[0]
-        num_objects_in_sample = len(object_indices)
-
-        if idx == 0:
-            sample_obj_indices = np.arange(0, num_objects_in_sample, dtype=np.int32)
-            obj_indices.append(sample_obj_indices)
-            last_num_objects = num_objects_in_sample
-        else:
-            start, upto = last_num_objects, last_num_objects + num_objects_in_sample
-            sample_obj_indices = np.arange(start, upto, dtype=np.int32)
-            obj_indices.append(sample_obj_indices)
-            last_num_objects = upto
+        Returns
+        -------
+        np.array
+            Labels of shape [#Objects, 5]
+        """
+
+        label_path = "{}/labels/{}.txt".format(self.path, uuid)
+        with open(label_path, "r") as fp:
+            content = " ".join(line.partition("#")[0] for line in fp)
 
-    return obj_indices
+        labels = np.fromstring(content, dtype=np.float32, sep=" ")
+        return labels.reshape((-1, 5))
 
 
-def create_positional_encodings(fm_shape, num_pos_feats, batch_size):
+def create_positional_encodings(fm_shape, num_pos_feats, dtype=tf.float32):
     """Helper function to create the positional encodings used in the
     transformer network of sinus type.
 
@@ -269,42 +421,44 @@ def create_positional_encodings(fm_shape, num_pos_feats, batch_size):
         Number of dimensions to express each position in. As both the x and y
         coordinate is expressed in `num_pos_feats` dimensions and then added,
         this number should be 0.5 * dim_transformer.
-    batch_size : int
+    dtype : tf.DType, optional
+        Float type of the returned encodings, e.g. `tf.float16` or `tf.bfloat16`
+        to match a transformer computing in reduced precision.
 
     Returns
     -------
     tf.Tensor
-            Positional encodings of shape [Batch Size, H*W, dim_transformer].
-            Used in transformer network to enrich input information.
+            Positional encodings of shape [1, H*W, dim_transformer].
+            Used in transformer network to enrich input information. The batch dimension
+            is broadcasted when adding the encodings to the transformer inputs.
     """
     height, width, c = fm_shape
 
-    y_embed = np.repeat(np.arange(1, height + 1), width).reshape(height, width)
-    x_embed = np.full(shape=(height, width), fill_value=np.arange(1, width + 1))
+    y_embed, x_embed = np.meshgrid(
+        np.arange(1, height + 1, dtype=np.float32),
+        np.arange(1, width + 1, dtype=np.float32),
+        indexing="ij",
+    )
 
-    # d/2 entries for each dimension x and y
-    div_term = np.arange(num_pos_feats)
-    div_term = 10000 ** (2 * (div_term // 2) / num_pos_feats)
+    # d/4 frequencies for each dimension x and y, each used for a sine and a cosine
+    div_term = np.arange(0, num_pos_feats, 2, dtype=np.float32)
+    div_term = np.power(10000.0, div_term / num_pos_feats, dtype=np.float32)
     pos_x = x_embed[:, :, None] / div_term
     pos_y = y_embed[:, :, None] / div_term
 
-    pos_x_even = np.sin(pos_x[:, :, 0::2])
-    pos_x_uneven = np.sin(pos_x[:, :, 1::2])
-
-    pos_y_even = np.sin(pos_y[:, :, 0::2])
-    pos_y_uneven = np.sin(pos_y[:, :, 1::2])
-
-    pos_x = np.concatenate([pos_x_even, pos_x_uneven], axis=2)
-    pos_y = np.concatenate([pos_y_even, pos_y_uneven], axis=2)
+    # Interleave sine and cosine features to [H, W, num_pos_feats]. For an odd
+    # `num_pos_feats` the last cosine feature is dropped
+    pos_x = np.stack([np.sin(pos_x), np.cos(pos_x)], axis=3)
+    pos_x = pos_x.reshape(height, width, -1)[:, :, :num_pos_feats]
+    pos_y = np.stack([np.sin(pos_y), np.cos(pos_y)], axis=3)
+    pos_y = pos_y.reshape(height, width, -1)[:, :, :num_pos_feats]
 
     positional_encodings = np.concatenate([pos_y, pos_x], axis=2)
-    positional_encodings = np.expand_dims(positional_encodings, 0)
-    positional_encodings = np.repeat(positional_encodings, batch_size, axis=0)
+    positional_encodings = np.ascontiguousarray(
+        positional_encodings.reshape(1, height * width, 2 * num_pos_feats)
+    )
 
     positional_encodings = tf.convert_to_tensor(positional_encodings, dtype=tf.float32)
-    positional_encodings = tf.reshape(
-        positional_encodings,
-        shape=(batch_size, height * width, positional_encodings.shape[3]),
-    )
+    positional_encodings = tf.cast(positional_encodings, dtype=dtype)
 
     return positional_encodings
@@ -1,6 +1,3 @@
-# IPDB can be used for debugging.
-# Ignoring flake8 error code F401
-import ipdb  # noqa: F401
 import keras.backend as K
 import tensorflow as tf
 import tensorflow_addons as tfa
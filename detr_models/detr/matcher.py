@@ -1,11 +1,7 @@
 """Summary
 """
-# IPDB can be used for debugging.
-# Ignoring flake8 error code F401
-import ipdb  # noqa: F401
 import tensorflow as tf
 import tensorflow_addons as tfa
-from detr_models.detr.config import DefaultDETRConfig
 from detr_models.detr.utils import box_cxcywh_to_xyxy
 from scipy.optimize import linear_sum_assignment
 
@@ -68,6 +64,8 @@ def prepare_cost_matrix(
     detr_bbox,
     batch_cls,
     batch_bbox,
+    num_queries,
+    num_classes,
     l1_cost_factor=tf.constant(5.0, dtype=tf.float32),
     iou_cost_factor=tf.constant(2.0, dtype=tf.float32),
 ):
@@ -84,6 +82,10 @@ def prepare_cost_matrix(
         Batch class targets of shape [Batch Size, #Queries, 1].
     batch_bbox : tf.Tensor
         Batch bounding box targets of shape [Batch Size, #Queries, 4].
+    num_queries : int
+        Number of queries used in transformer.
+    num_classes : int
+        Number of target classes. Also the value the class targets are padded with.
     l1_cost_factor : tf.Tensor, optional
         Cost factor for L1-loss.
     iou_cost_factor : tf.Tensor, optional
@@ -97,23 +99,25 @@ def prepare_cost_matrix(
         these get sliced to match only the considered sample.
     """
 
-    config = DefaultDETRConfig()
     batch_size = tf.shape(detr_scores)[0]
-    num_queries = config.num_queries
-    num_classes = config.num_classes + 1
 
     # Prepare Outputs
     # [BS * #Queries , #Cls]
     # [BS * #Queries , #Coord]
     out_prob = tf.nn.softmax(
-        tf.reshape(detr_scores, shape=(batch_size * num_queries, num_classes)), -1
+        tf.reshape(detr_scores, shape=(batch_size * num_queries, num_classes + 1)),
+        -1,
     )
     out_bbox = tf.reshape(detr_bbox, shape=(batch_size * num_queries, 4))
 
+    # Positions of the objects in the batch [#Obj, 2]
+    # Queries padded with `num_classes` don't hold an object
+    obj_mask = tf.where(tf.not_equal(batch_cls[:, :, 0], num_classes))
+
     # Cls Costs
     # Objekt Klassen in Batch
     # [Class_Obj1, Class_Obj2, ...]
-    obj_classes = tf.gather_nd(batch_cls, tf.where(tf.not_equal(batch_cls, 4)))
+    obj_classes = tf.gather_nd(batch_cls[:, :, 0], obj_mask)
     obj_classes = tf.cast(obj_classes, dtype=tf.int64)
     num_objects = tf.size(obj_classes)
     one = tf.constant(1, dtype=tf.int32)
@@ -127,7 +131,7 @@ def prepare_cost_matrix(
     # BBOX Costs
     # Objekt Bounding Boxes in Batch
     # [#Obj , #Coord]
-    obj_bboxes_xywh = tf.gather_nd(batch_bbox, tf.where(tf.not_equal(batch_bbox, 4)))
+    obj_bboxes_xywh = tf.gather_nd(batch_bbox, obj_mask)
     obj_bboxes_xywh = tf.reshape(obj_bboxes_xywh, shape=[num_objects, 4])
     obj_bboxes_xyxy = box_cxcywh_to_xyxy(obj_bboxes_xywh)
 
@@ -163,7 +167,9 @@ def prepare_cost_matrix(
 
 
 @tf.function
-def bipartite_matching(detr_scores, detr_bbox, batch_cls, batch_bbox, obj_indices):
+def bipartite_matching(
+    detr_scores, detr_bbox, batch_cls, batch_bbox, obj_indices, num_queries, num_classes
+):
     """Execute the bipartite matching. Given the output scores and bounding boxes, we
     first create a cost matrix using the negative log probabilities, GIoU and L1 loss.
     Then, we assign each object the best fitting (minimal cost) query.
@@ -178,6 +184,13 @@ def bipartite_matching(detr_scores, detr_bbox, batch_cls, batch_bbox, obj_indice
         Batch class targets of shape [Batch Size, #Queries, 1].
     batch_bbox : tf.Tensor
         Batch bounding box targets of shape [Batch Size, #Queries, 4].
+    obj_indices : tf.RaggedTensor
+        Helper tensor of shape [Batch Size, None].
+        Used to link objects in the cost matrix to the target tensors.
+    num_queries : int
+        Number of queries used in transformer.
+    num_classes : int
+        Number of target classes. Also the value the class targets are padded with.
 
     Returns
     -------
@@ -188,7 +201,9 @@ def bipartite_matching(detr_scores, detr_bbox, batch_cls, batch_bbox, obj_indice
         the indices got padded with `-1` to match `max_obj` in order to constitute a regular tensor.
     """
 
-    cost_matrix = prepare_cost_matrix(detr_scores, detr_bbox, batch_cls, batch_bbox)
+    cost_matrix = prepare_cost_matrix(
+        detr_scores, detr_bbox, batch_cls, batch_bbox, num_queries, num_classes
+    )
 
     batch_idx = tf.map_fn(
         lambda elems: tf_linear_sum_assignment(*elems),
@@ -1,9 +1,6 @@
 import time
 import warnings
 
-# IPDB can be used for debugging.
-# Ignoring flake8 error code F401
-import ipdb  # noqa: F401
 import numpy as np
 import tensorflow as tf
 from detr_models.backbone.backbone import Backbone
@@ -11,7 +8,6 @@ from detr_models.detr.data_feeder import DataFeeder
 from detr_models.detr.losses import bbox_loss, score_loss
 from detr_models.detr.matcher import bipartite_matching
 from detr_models.detr.utils import save_training_loss
-from detr_models.detr.uuid_iterator import UUIDIterator
 from detr_models.transformer.transformer import Transformer
 from tensorflow.keras import Model
 
@@ -35,6 +31,7 @@ class DETR:
         backbone_name,
         backbone_config,
         train_backbone=False,
+        cache_path=None,
     ):
         """Initialize Detection Transformer (DETR) network.
 
@@ -63,6 +60,9 @@ class DETR:
             Config of backbone used for DETR network.
         train_backbone : bool, optional
             Flag to indicate training/inference mode.
+        cache_path : str, optional
+            Path to cache the decoded images at. By default, images are decoded
+            from `storage_path` in every epoch.
         """
 
         # Save object parameters
@@ -85,15 +85,16 @@ class DETR:
             dim_transformer,
         )
 
-        # Init Feeder and Iterator
-        self.uuiditerator = UUIDIterator(storage_path)
+        # Init Feeder
         self.feeder = DataFeeder(
             storage_path,
+            input_shape,
             num_queries,
             num_classes,
             self.fm_shape,
             dim_transformer,
             batch_size,
+            cache_path,
         )
 
     def build_model(self):
@@ -104,11 +105,17 @@ class DETR:
         tf.Model
             Detection Transformer (DETR) model
         """
-        batch_input = tf.keras.layers.Input(shape=self.input_shape, name="Batch_Input")
+        batch_input = tf.keras.layers.Input(
+            shape=self.input_shape, dtype=tf.uint8, name="Batch_Input"
+        )
         positional_encodings = tf.keras.layers.Input(
-            shape=self.positional_encodings_shape, name="Positional_Encodings_Input"
+            shape=self.positional_encodings_shape,
+            dtype=self.feeder.positional_encodings.dtype,
+            name="Positional_Encodings_Input",
         )
-        feature_map = self.backbone(batch_input)
+
+        # Images are fed as uint8 and only get casted on the device
+        feature_map = self.backbone(tf.cast(batch_input, dtype=tf.float32))
 
         transformer_input = tf.keras.layers.Conv2D(self.dim_transformer, kernel_size=1)(
             feature_map
@@ -162,6 +169,7 @@ class DETR:
 
     def train(
         self,
+        dataset,
         epochs,
         optimizer,
         batch_size,
@@ -173,6 +181,9 @@ class DETR:
 
         Parameters
         ----------
+        dataset : tf.data.Dataset
+            Input pipeline yielding the batch inputs, class targets, bounding box targets
+            and object indices as returned by `DataFeeder.finalize_batch`.
         epochs : int
             Number of training epochs.
         optimizer : tf.Optimizer
@@ -217,7 +228,7 @@ class DETR:
             batch_iteration = 0
 
             # Iterate over all batches
-            for batch_uuids in self.uuiditerator(batch_size):
+            for batch_inputs, batch_cls, batch_bbox, obj_indices in dataset:
                 print(
                     "Batch: {}/{}".format(
                         batch_iteration + 1, count_images // batch_size
@@ -226,14 +237,6 @@ class DETR:
                     end="\r",
                 )
 
-                (
-                    batch_inputs,
-                    batch_cls,
-                    batch_bbox,
-                    obj_indices,
-                    positional_encodings,
-                ) = self.feeder(batch_uuids)
-
                 batch_loss = _train(
                     detr=model,
                     optimizer=optimizer,
@@ -241,11 +244,13 @@ class DETR:
                     batch_cls=batch_cls,
                     batch_bbox=batch_bbox,
                     obj_indices=obj_indices,
-                    positional_encodings=positional_encodings,
+                    positional_encodings=self.feeder.positional_encodings,
+                    num_queries=self.num_queries,
+                    num_classes=self.num_classes,
                 )
 
                 batch_loss = [loss.numpy() for loss in batch_loss]
-                epoch_loss += (1 / len(batch_uuids)) * np.array(batch_loss)
+                epoch_loss += (1 / batch_size) * np.array(batch_loss)
                 batch_iteration += 1
 
             detr_loss.append(epoch_loss)
@@ -272,6 +277,8 @@ def _train(
     batch_bbox,
     obj_indices,
     positional_encodings,
+    num_queries,
+    num_classes,
 ):
     """Train step of the DETR network.
 
@@ -282,7 +289,7 @@ def _train(
     optimizer : tf.Optimizer
         Any chosen optimizer used for training.
     batch_inputs : tf.Tensor
-        Batch input images of shape [Batch Size, H, W, C].
+        Batch input images of shape [Batch Size, H, W, C] and type uint8.
     batch_cls : tf.Tensor
         Batch class targets of shape [Batch Size, #Queries, 1].
     batch_bbox : tf.Tensor
@@ -291,8 +298,12 @@ def _train(
         Helper tensor of shape [Batch Size, None].
         Used to link objects in the cost matrix to the target tensors.
     positional_encodings : tf.Tensor
-        Positional encodings of shape [Batch Size, H*W, dim_transformer].
+        Positional encodings of shape [1, H*W, dim_transformer].
         Used in transformer network to enrich input information.
+    num_queries : int
+        Number of queries used in transformer.
+    num_classes : int
+        Number of target classes, used as padding value of the targets.
     """
 
     with tf.GradientTape() as gradient_tape:
@@ -301,7 +312,13 @@ def _train(
         )
 
         indices = bipartite_matching(
-            detr_scores, detr_bbox, batch_cls, batch_bbox, obj_indices
+            detr_scores,
+            detr_bbox,
+            batch_cls,
+            batch_bbox,
+            obj_indices,
+            num_queries,
+            num_classes,
         )
 
         score_loss = calculate_score_loss(batch_cls, detr_scores, indices)
@@ -2,12 +2,10 @@ import argparse
 import os
 from pathlib import Path
 
-# IPDB can be used for debugging.
-# Ignoring flake8 error code F401
-import ipdb  # noqa: F401
 import tensorflow as tf
 from detr_models.detr.config import DefaultDETRConfig
 from detr_models.detr.model import DETR
+from detr_models.detr.uuid_iterator import UUIDIterator
 from tensorflow.keras.preprocessing.image import img_to_array, load_img
 
 tf.keras.backend.set_floatx("float32")
@@ -95,6 +93,12 @@ def get_args_parser():
         help="Flag to indicate training of backbone",
         action="store_true",
     )
+    parser.add_argument(
+        "-cp",
+        "--cache_path",
+        help="Path to cache the decoded images at",
+        type=str,
+    )
     parser.add_argument(
         "-gpu",
         "--use_gpu",
@@ -130,6 +134,44 @@ def get_image_information(storage_path):
     return input_shape, count_images
 
 
+def create_dataset(feeder, storage_path, batch_size):
+    """Create the `tf.data` input pipeline, which loads and prepares the training data
+    in parallel to the training step.
+
+    Parameters
+    ----------
+    feeder : DataFeeder
+        Data feeder used to load the samples and prepare the batch targets.
+    storage_path : str
+        Path to data storage
+    batch_size : int
+        Number of samples per batch.
+
+    Returns
+    -------
+    tf.data.Dataset
+        Dataset yielding the batch inputs, class targets, bounding box targets and object
+        indices of each batch.
+    """
+    uuids = UUIDIterator(storage_path)().ravel()
+    num_batches = len(uuids) // batch_size
+
+    dataset = tf.data.Dataset.from_tensor_slices(uuids)
+    dataset = dataset.shuffle(len(uuids), reshuffle_each_iteration=True)
+    dataset = dataset.map(
+        feeder.load_sample, num_parallel_calls=tf.data.experimental.AUTOTUNE
+    )
+    dataset = dataset.apply(
+        tf.data.experimental.dense_to_ragged_batch(batch_size, drop_remainder=True)
+    )
+    dataset = dataset.map(
+        feeder.finalize_batch, num_parallel_calls=tf.data.experimental.AUTOTUNE
+    )
+    dataset = dataset.apply(tf.data.experimental.assert_cardinality(num_batches))
+
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+
 def init_training(args):
     """Initialize DETR training procedure
 
@@ -166,11 +208,15 @@ def init_training(args):
         backbone_name=args.backbone_name,
         backbone_config=backbone_config,
         train_backbone=args.train_backbone,
+        cache_path=args.cache_path,
     )
 
     optimizer = tf.keras.optimizers.Adam(args.learning_rate)
 
+    dataset = create_dataset(detr.feeder, args.storage_path, args.batch_size)
+
     detr.train(
+        dataset=dataset,
         epochs=args.epochs,
         optimizer=optimizer,
         batch_size=args.batch_size,
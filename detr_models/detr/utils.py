@@ -2,7 +2,6 @@
 """
 import pickle
 
-import ipdb  # noqa: F401
 import numpy as np
 import tensorflow as tf
 
@@ -3,7 +3,6 @@
 Taken and adjusted from: https://www.tensorflow.org/tutorials/text/transformer#multi-head_attention
 """
 
-import ipdb  # noqa: F401
 import tensorflow as tf
 from detr_models.transformer.attention import MultiHeadAttention
 
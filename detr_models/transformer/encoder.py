@@ -3,7 +3,6 @@
 Taken and adjusted from: https://www.tensorflow.org/tutorials/text/transformer#multi-head_attention
 """
 
-import ipdb  # noqa: F401
 import tensorflow as tf
 from detr_models.transformer.attention import MultiHeadAttention
 
@@ -51,6 +50,8 @@ class TransformerEncoderLayer(tf.keras.layers.Layer):
 
     def __call__(self, src, positional_encodings, training=True):
 
+        # Positional encodings of shape [1, H*W, dim_transformer] are broadcasted
+        # over the batch dimension of `src`
         q = k = src + positional_encodings
 
         attn_output, attention_weights = self.selt_attn(src, k, q)